@@ -0,0 +1,100 @@
+#########################################################################################
+# Compare reads/sec of a single collection stream with partitioned parallel streams.
+# Uses an in-memory stand-in for Firestore that simulates RPC latency, so it doesn't need GCP credentials.
+#
+# Run from the repository root: python benchmarks/parallel_reader_benchmark.py
+#########################################################################################
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from parallel_reader import stream_collection_parallel
+
+NUM_DOCS = 20000
+BATCH_SIZE = 300 # documents returned per simulated RPC response
+FIRST_RESPONSE_LATENCY = 0.1 # seconds
+BATCH_LATENCY = 0.03 # seconds
+
+class FakeSnapshot:
+    def __init__(self, data):
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+class FakeQuery:
+    """
+    Query over a range of document ids [start, end) in a sorted in-memory collection
+    """
+    def __init__(self, docs, start, end, field_paths=None):
+        self.docs = docs
+        self.start = start
+        self.end = end
+        self.field_paths = field_paths
+
+    def select(self, field_paths):
+        return FakeQuery(self.docs, self.start, self.end, field_paths)
+
+    def stream(self):
+        time.sleep(FIRST_RESPONSE_LATENCY)
+        for n, (_, doc) in enumerate(self.docs[self.start:self.end]):
+            if n > 0 and n % BATCH_SIZE == 0:
+                time.sleep(BATCH_LATENCY)
+            if self.field_paths is not None:
+                doc = {key: doc[key] for key in self.field_paths if key in doc}
+            yield FakeSnapshot(doc)
+
+class FakePartition:
+    def __init__(self, query):
+        self._query = query
+
+    def query(self):
+        return self._query
+
+class FakeCollectionGroup:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def get_partitions(self, partition_count):
+        """
+        Split documents into partition_count document id ranges
+        """
+        step = (len(self.docs) + partition_count - 1) // partition_count
+        for start in range(0, len(self.docs), step):
+            yield FakePartition(FakeQuery(self.docs, start, min(start + step, len(self.docs))))
+
+class FakeDb:
+    def __init__(self, collections):
+        self.collections = {name: sorted(docs.items()) for name, docs in collections.items()}
+
+    def collection_group(self, name):
+        return FakeCollectionGroup(self.collections[name])
+
+def make_tweets(n):
+    return {
+        str(1470000000000000000 + i): {
+            "id": str(1470000000000000000 + i),
+            "author_id": str(1000 + i % 500),
+            "text": "gm " * 40,
+            "created_at": "2021-12-09T12:34:00.000Z",
+            "public_metrics": {"retweet_count": i % 7, "reply_count": 0, "like_count": i % 13, "quote_count": 0},
+        }
+        for i in range(n)
+    }
+
+def measure(db, partition_count, field_paths=None):
+    start = time.perf_counter()
+    count = sum(1 for _ in stream_collection_parallel(db, "tweets", field_paths=field_paths, partition_count=partition_count))
+    elapsed = time.perf_counter() - start
+    return count, elapsed
+
+if __name__ == "__main__":
+    db = FakeDb({"tweets": make_tweets(NUM_DOCS)})
+    for partition_count in [1, 2, 4, 8, 16]:
+        count, elapsed = measure(db, partition_count)
+        print(f"partitions={partition_count:2d} docs={count} time={elapsed:.2f}s reads/sec={count / elapsed:.0f}")
+    count, elapsed = measure(db, 8, field_paths=["author_id"])
+    print(f"partitions= 8 projection=[author_id] docs={count} time={elapsed:.2f}s reads/sec={count / elapsed:.0f}")
@@ -0,0 +1,113 @@
+#########################################################################################
+# Compare peak memory of keeping fetched tweets and likes as raw json dicts vs compact records.
+# Simulates one download_new_tweets_and_likes_for_user invocation at its limits:
+# 3200 user tweets, 7500 likes and 5000 hydrated referenced/liked tweets.
+#
+# Run from the repository root: python benchmarks/records_memory_benchmark.py
+#########################################################################################
+
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from records import parse_tweets, parse_likes, get_fetched_at
+
+NUM_TWEETS = 3200
+NUM_LIKES = 7500
+NUM_HYDRATED_TWEETS = 5000
+PAGE_SIZE = 100
+USER_ID = 1234567
+
+USERNAMES = [f"user{n}" for n in range(300)]
+HASHTAGS = ["web3", "nft", "dao", "defi", "eth", "btc", "crypto", "gm"]
+
+def make_tweet_json(rng, n):
+    """
+    Returns tweet json similar to what Twitter API returns for TWEET_FIELDS
+    """
+    tweet_id = str(1470000000000000000 + n)
+    url = f"https://example.com/article/{rng.randrange(2000)}"
+    mentions = rng.sample(USERNAMES, 2)
+    return {
+        "id": tweet_id,
+        "text": "gm frens, check this out " * 6 + url,
+        "author_id": str(1000 + rng.randrange(300)),
+        "created_at": "2021-12-09T12:34:00.000Z",
+        "public_metrics": {"retweet_count": rng.randrange(100), "reply_count": rng.randrange(50), "like_count": rng.randrange(1000), "quote_count": rng.randrange(20)},
+        "entities": {
+            "urls": [{
+                "start": 150, "end": 173, "url": "https://t.co/abcdefghij",
+                "expanded_url": url, "display_url": url[8:],
+                "status": 200, "title": "Some article title", "description": "Some article description " * 3,
+                "unwound_url": url,
+            }],
+            "hashtags": [{"start": 10, "end": 15, "tag": tag} for tag in rng.sample(HASHTAGS, 2)],
+            "mentions": [{"start": 0, "end": 9, "username": username, "id": str(2000 + USERNAMES.index(username))} for username in mentions],
+            "annotations": [{"start": 20, "end": 30, "probability": 0.5, "type": "Organization", "normalized_text": "Ethereum"}],
+        },
+        "referenced_tweets": [{"type": "quoted", "id": str(1460000000000000000 + rng.randrange(10 ** 6))}],
+    }
+
+def make_like_json(n):
+    return {
+        "id": str(1460000000000000000 + n),
+        "created_at": "2021-12-09T12:34:00.000Z",
+        "text": "some liked tweet text that we don't store " * 4,
+    }
+
+def make_pages(items):
+    """
+    Serialize items into json response bodies of PAGE_SIZE items, the way they arrive over the network
+    """
+    return [json.dumps({"data": items[n:n + PAGE_SIZE]}) for n in range(0, len(items), PAGE_SIZE)]
+
+def fetch_as_dicts(tweet_pages, like_pages):
+    fetched_at = get_fetched_at()
+    tweets = []
+    likes = []
+    for page in tweet_pages:
+        data = json.loads(page)["data"]
+        for tweet in data:
+            tweet["fetched_at"] = fetched_at
+        tweets.extend(data)
+    for page in like_pages:
+        data = json.loads(page)["data"]
+        for like in data:
+            like["liked_by_user_id"] = USER_ID
+        likes.extend(data)
+    return tweets, likes
+
+def fetch_as_records(tweet_pages, like_pages):
+    tweets = []
+    likes = []
+    for page in tweet_pages:
+        tweets.extend(parse_tweets(json.loads(page)["data"]))
+    for page in like_pages:
+        likes.extend(parse_likes(json.loads(page)["data"], USER_ID))
+    return tweets, likes
+
+def measure_peak(fetch, tweet_pages, like_pages):
+    tracemalloc.start()
+    result = fetch(tweet_pages, like_pages)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak
+
+if __name__ == "__main__":
+    rng = random.Random(42)
+    tweets = [make_tweet_json(rng, n) for n in range(NUM_TWEETS + NUM_HYDRATED_TWEETS)]
+    likes = [make_like_json(n) for n in range(NUM_LIKES)]
+    tweet_pages = make_pages(tweets)
+    like_pages = make_pages(likes)
+    del tweets, likes
+
+    dicts_peak = measure_peak(fetch_as_dicts, tweet_pages, like_pages)
+    records_peak = measure_peak(fetch_as_records, tweet_pages, like_pages)
+    print(f"{NUM_TWEETS + NUM_HYDRATED_TWEETS} tweets, {NUM_LIKES} likes")
+    print(f"raw json dicts: peak {dicts_peak / 1024 / 1024:.1f}MB")
+    print(f"compact records: peak {records_peak / 1024 / 1024:.1f}MB ({100.0 * (1 - records_peak / dicts_peak):.0f}% less)")
@@ -0,0 +1,108 @@
+#########################################################################################
+# Count Firestore reads and writes of storing tweets with and without FirestoreWriteDeduper
+# over one simulated workflow run, using an in-memory stand-in for Firestore that counts operations.
+#
+# Each influencer invocation stores its own new tweets, plus referenced and liked tweets. Those are drawn
+# from a shared pool with a skewed distribution, since popular tweets get referenced by many influencers.
+#
+# Run from the repository root: python benchmarks/write_dedup_benchmark.py
+#########################################################################################
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from write_dedup import FirestoreWriteDeduper
+
+NUM_INFLUENCERS = 100
+OWN_TWEETS_PER_INFLUENCER = 20
+REFERENCED_TWEETS_PER_INFLUENCER = 80
+REFERENCED_TWEETS_POOL = 3000
+
+class FakeSnapshot:
+    def __init__(self, id, data):
+        self.id = id
+        self.exists = data is not None
+        self.data = data
+
+    def to_dict(self):
+        return self.data
+
+class FakeDocument:
+    def __init__(self, db, path, id):
+        self.db = db
+        self.path = path
+        self.id = id
+
+    def get(self):
+        self.db.reads += 1
+        return FakeSnapshot(self.id, self.db.docs.get(self.path))
+
+    def set(self, data):
+        self.db.writes += 1
+        if "packed" in data:
+            self.db.shard_writes += 1
+            self.db.shard_bytes += len(data["packed"])
+        self.db.docs[self.path] = data
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def document(self, id):
+        return FakeDocument(self.db, f"{self.name}/{id}", id)
+
+class FakeDb:
+    def __init__(self):
+        self.docs = {}
+        self.reads = 0
+        self.writes = 0
+        self.shard_writes = 0
+        self.shard_bytes = 0
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def get_all(self, refs):
+        return [ref.get() for ref in refs]
+
+def make_tweet(tweet_id):
+    return {
+        "id": tweet_id,
+        "text": "gm frens " * 20,
+        "author_id": "1234",
+        "created_at": "2021-12-09T12:34:00.000Z",
+        "public_metrics": {"retweet_count": 1, "reply_count": 2, "like_count": 3, "quote_count": 4},
+    }
+
+def simulate_run(use_deduper):
+    rng = random.Random(42)
+    db = FakeDb()
+    next_own_id = 1480000000000000000
+    for _ in range(NUM_INFLUENCERS):
+        tweet_ids = [str(next_own_id + n) for n in range(OWN_TWEETS_PER_INFLUENCER)]
+        next_own_id += OWN_TWEETS_PER_INFLUENCER
+        # skewed draws: lower pool indexes are much more popular
+        tweet_ids += list(set(str(1470000000000000000 + int(REFERENCED_TWEETS_POOL * rng.random() ** 3)) for _ in range(REFERENCED_TWEETS_PER_INFLUENCER)))
+        if use_deduper:
+            deduper = FirestoreWriteDeduper(db, "tweets")
+            for tweet_id in tweet_ids:
+                deduper.set(tweet_id, make_tweet(tweet_id))
+            deduper.flush()
+        else:
+            for tweet_id in tweet_ids:
+                db.collection("tweets").document(tweet_id).set(make_tweet(tweet_id))
+    return db
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.INFO)
+    baseline = simulate_run(use_deduper=False)
+    deduped = simulate_run(use_deduper=True)
+    print(f"{NUM_INFLUENCERS} invocations, {OWN_TWEETS_PER_INFLUENCER} own + up to {REFERENCED_TWEETS_PER_INFLUENCER} referenced tweets each")
+    print(f"without deduper: {baseline.writes} writes, {baseline.reads} reads")
+    print(f"with deduper:    {deduped.writes} writes ({deduped.shard_writes} of them digest shards, {deduped.shard_bytes // deduped.shard_writes // 1024}KB on average), {deduped.reads} reads")
+    print(f"net writes saved: {baseline.writes - deduped.writes} ({100.0 * (1 - deduped.writes / baseline.writes):.0f}%)")
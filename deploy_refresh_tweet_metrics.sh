@@ -0,0 +1,8 @@
+gcloud functions deploy refresh_tweet_metrics \
+        --region=us-west1 \
+        --memory=512MB \
+        --runtime=python39 \
+        --service-account=service-account@web3twitterdata.iam.gserviceaccount.com \
+        --source=./src \
+        --timeout=540s \
+        --trigger-http
\ No newline at end of file
@@ -0,0 +1,216 @@
+#########################################################################################
+# Opt-in CPU and memory profiling of HTTP Cloud Function invocations.
+# Profiling is enabled for a single request by the X-Profile-Invocation header,
+# or for all requests by PROFILE_INVOCATIONS environment variable.
+# When it's off, the only overhead is a header and environment lookup.
+#########################################################################################
+
+import datetime
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+PROFILE_HEADER = "X-Profile-Invocation"
+PROFILE_ENV_VAR = "PROFILE_INVOCATIONS"
+# If set, reports are written to files in this directory instead of logs
+PROFILE_OUTPUT_DIR_ENV_VAR = "PROFILE_OUTPUT_DIR"
+
+SAMPLING_INTERVAL = 0.01 # seconds
+TOP_N = 20
+# A new memory snapshot is taken when traced memory grows this much over the previous snapshot,
+# so that we end up with a snapshot close to the peak without taking one on every tick.
+SNAPSHOT_GROWTH_RATIO = 1.1
+SNAPSHOT_MIN_GROWTH = 1024 * 1024 # bytes
+
+def is_profiling_enabled(request):
+    """
+    Returns True if the request or the environment asks for profiling
+    """
+    if os.environ.get(PROFILE_ENV_VAR, "") not in ("", "0"):
+        return True
+    headers = getattr(request, "headers", None)
+    return headers is not None and headers.get(PROFILE_HEADER, "") not in ("", "0")
+
+# Leaf frames of threads that are blocked waiting, rather than running. Samples that end in them are counted as idle.
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("queue.py", "put"),
+    ("selectors.py", "select"),
+    ("_base.py", "result"), # concurrent.futures
+}
+
+class SamplingProfiler:
+    """
+    Periodically samples call stacks of the handler thread and the threads started after the profiler was created
+    (e.g. thread pools used by the handler), from a background thread. Other threads of the process, like
+    framework, gRPC or logging threads, are ignored.
+
+    Samples are taken on wall-clock time. Samples of threads blocked in waits (see IDLE_FRAMES) are counted as idle
+    and left out of the function lists, so that the lists approximate where CPU time goes.
+
+    If tracemalloc is tracing, the same thread also keeps a tracemalloc snapshot taken close to the memory high-water mark
+    in peak_snapshot, since by the end of the invocation most of that memory is already freed.
+
+    Usage:
+        profiler = SamplingProfiler(threading.get_ident())
+        profiler.start()
+        ... do work ...
+        profiler.stop()
+        print(profiler.report())
+    """
+
+    def __init__(self, handler_thread_id, interval=SAMPLING_INTERVAL):
+        self.handler_thread_id = handler_thread_id
+        self.ignored_thread_ids = set(thread.ident for thread in threading.enumerate()) - {handler_thread_id}
+        self.interval = interval
+        self.ticks = 0 # number of times we sampled
+        self.samples = 0 # number of sampled thread stacks, excluding idle ones
+        self.idle_samples = 0
+        self.peak_snapshot = None
+        self.peak_snapshot_size = 0
+        self.self_counts = Counter() # function was on top of the stack
+        self.total_counts = Counter() # function was anywhere in the stack
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        own_thread_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            self.ticks += 1
+            self._check_memory()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id or thread_id in self.ignored_thread_ids:
+                    continue
+                if self._is_idle(frame):
+                    self.idle_samples += 1
+                    continue
+                self.samples += 1
+                self.self_counts[self._frame_key(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    seen.add(self._frame_key(frame))
+                    frame = frame.f_back
+                self.total_counts.update(seen)
+
+    def _check_memory(self):
+        if not tracemalloc.is_tracing():
+            return
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self.peak_snapshot_size * SNAPSHOT_GROWTH_RATIO and current - self.peak_snapshot_size > SNAPSHOT_MIN_GROWTH:
+            self.peak_snapshot = tracemalloc.take_snapshot()
+            self.peak_snapshot_size = current
+
+    @staticmethod
+    def _is_idle(frame):
+        return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+    @staticmethod
+    def _frame_key(frame):
+        code = frame.f_code
+        return (code.co_filename, code.co_firstlineno, code.co_name)
+
+    def report(self, top_n=TOP_N):
+        """
+        Returns text with top_n functions by number of samples where they were running (self)
+        and where they were anywhere in the call stack (total)
+        """
+        lines = [
+            f"Stack samples of the handler thread and threads it started, every {self.interval * 1000:.0f}ms for {self.ticks} ticks:"
+            f" {self.samples} running, {self.idle_samples} idle (waiting, not included below)"
+        ]
+        for title, counts in [("self", self.self_counts), ("total", self.total_counts)]:
+            lines.append(f"Top functions by {title} samples:")
+            for (filename, lineno, name), count in counts.most_common(top_n):
+                lines.append(f"  {count:6d} {100.0 * count / max(self.samples, 1):5.1f}%  {name} ({filename}:{lineno})")
+        return "\n".join(lines)
+
+def get_allocation_sites_report(title, snapshot, top_n=TOP_N):
+    """
+    Returns text with top_n allocation sites from a tracemalloc snapshot
+    """
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    lines = [title]
+    for stat in snapshot.statistics("lineno")[:top_n]:
+        frame = stat.traceback[0]
+        lines.append(f"  {stat.size / 1024:10.1f}KB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines)
+
+def get_memory_report(peak_snapshot, peak_snapshot_size, end_snapshot, peak, top_n=TOP_N):
+    """
+    Returns text with top_n allocation sites close to the memory peak, and at the end of the invocation
+    (memory that's still alive, e.g. module-level caches)
+    """
+    lines = [f"Peak traced memory: {peak / 1024 / 1024:.1f}MB"]
+    if peak_snapshot is not None:
+        lines.append(get_allocation_sites_report(f"Top allocation sites near the peak, at {peak_snapshot_size / 1024 / 1024:.1f}MB:", peak_snapshot, top_n))
+    lines.append(get_allocation_sites_report("Top allocation sites of memory alive at the end:", end_snapshot, top_n))
+    return "\n".join(lines)
+
+def write_report(name, report):
+    """
+    Write profiling report either to a file in PROFILE_OUTPUT_DIR or to logs
+    """
+    output_dir = os.environ.get(PROFILE_OUTPUT_DIR_ENV_VAR)
+    if output_dir:
+        timestamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        path = os.path.join(output_dir, f"{name}_{timestamp}.txt")
+        with open(path, "w") as f:
+            f.write(report)
+        logging.info("Profiling report for %s written to %s", name, path)
+    else:
+        logging.info("Profiling report for %s:\n%s", name, report)
+
+def profile_invocation(func):
+    """
+    Decorator for HTTP Cloud Functions that profiles CPU and memory usage of an invocation when it's requested.
+    """
+    @functools.wraps(func)
+    def wrapper(request):
+        if not is_profiling_enabled(request):
+            return func(request)
+
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profiler = SamplingProfiler(threading.get_ident())
+        profiler.start()
+        start = time.perf_counter()
+        try:
+            return func(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            # profiling must never change the response of the function
+            try:
+                profiler.stop()
+                end_snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                report = "\n".join([
+                    f"Wall time: {elapsed:.2f}s",
+                    profiler.report(),
+                    get_memory_report(profiler.peak_snapshot, profiler.peak_snapshot_size, end_snapshot, peak),
+                ])
+                write_report(func.__name__, report)
+            except Exception as ex:
+                logging.error("Failed to produce profiling report for %s: %s", func.__name__, ex)
+            finally:
+                if started_tracemalloc:
+                    tracemalloc.stop()
+    return wrapper
@@ -10,7 +10,12 @@ import time
 import pandas as pd
 import numpy as np
 import json
+import hashlib
 from raw_paginator import RawPaginator
+from write_dedup import FirestoreWriteDeduper, compute_digest, delete_digests
+from parallel_reader import stream_collection_parallel
+from invocation_profiler import profile_invocation
+from records import TweetRecord, get_fetched_at, parse_tweets, parse_likes
 
 if 'BEARER_TOKEN' in os.environ:
     TWITTER_CLIENT_RAW = tweepy.Client(bearer_token=os.environ['BEARER_TOKEN'], consumer_key=os.environ['API_KEY'], consumer_secret=os.environ['API_KEY_SECRET'], return_type=requests.Response)
@@ -95,6 +100,7 @@ def get_influencer_watermarks():
     """
     return BIGQUERY_CLIENT.query(query).to_dataframe()
 
+@profile_invocation
 def compute_influencer_watermarks(request):
     """
     Compute influencer watermarks and upload them to Firestore "influencer_watermarks" collection
@@ -124,36 +130,27 @@ def compute_influencer_watermarks(request):
     logging.info("Successfully uploaded watermarks to Firestore. Exiting now....")
     return (json.dumps({"watermarks": watermarks}), 200, RESPONSE_HEADERS)
 
-def set_fetched_at_field(tweets):
-    """
-    Sets fetched-at field for all tweets in the list.
-
-    The list is modified inplace.
-    Fetched at is set to the current time, which is fine for our purposes.
-    Returns the original list of tweets.
-    """
-    fetched_at = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
-    for tweet in tweets:
-        tweet["fetched_at"] = fetched_at
-    return tweets
-
-def get_tweets_by_ids(tweet_ids):
+def get_tweets_by_ids(tweet_ids, tweet_fields=None):
     """
     Queries Twitter API for tweets info by their ids.
 
-    Returns a list of tweet dictionaries. Fields in the dictionaries match TWEET_FIELDS constant
+    tweet_fields - list of fields to request, defaults to TWEET_FIELDS constant
+
+    Returns a list of TweetRecord. Fields in the records match tweet_fields
     """
     if len(tweet_ids) == 0:
         return []
+    if tweet_fields is None:
+        tweet_fields = TWEET_FIELDS
 
     BATCH_SIZE = 100
     tweets = []
     for n in range(int((len(tweet_ids) - 1)/BATCH_SIZE) + 1):
         batch = tweet_ids[n*BATCH_SIZE:min(len(tweet_ids), (n+1)*BATCH_SIZE)]
-        response = TWITTER_CLIENT_RAW.get_tweets(ids=batch, tweet_fields=TWEET_FIELDS)
+        response = TWITTER_CLIENT_RAW.get_tweets(ids=batch, tweet_fields=tweet_fields)
         response_json = response.json()
         if "data" in response_json:
-            tweets.extend(set_fetched_at_field(response_json["data"]))
+            tweets.extend(parse_tweets(response_json["data"]))
         else:
             logging.warning("No data returned for request %s", response.request.url)
         time.sleep(3) # to adhere to 300 req/15 minutes rate limit
@@ -162,24 +159,14 @@ def get_tweets_by_ids(tweet_ids):
     time.sleep(3)
     return tweets
 
-def add_liked_by_user_id_field(likes, user_id):
-    """
-    Sets "liked_by_user_id" field to user_id for likes in the list.
-
-    Returns the original list
-    """
-    for like in likes:
-        like["liked_by_user_id"] = user_id
-    return likes
-
 def get_tweets_and_likes_for_user(user_id, latest_seen_tweet_id, latest_seen_like_timestamp):
     """
     Queries Tweeter API for tweets and likes for a given user. Queries for referenced and liked tweets as well.
 
     Returns a dictionary:
     {
-        "tweets": [list of retrieved tweets],
-        "likes": [list of retrieved likes]
+        "tweets": [list of retrieved tweets as TweetRecord],
+        "likes": [list of retrieved likes as LikeRecord]
     }
     """
     tweets = []
@@ -188,7 +175,7 @@ def get_tweets_and_likes_for_user(user_id, latest_seen_tweet_id, latest_seen_lik
     for response in RawPaginator(TWITTER_CLIENT_RAW.get_users_tweets, user_id, max_results=100, limit=3200, tweet_fields=TWEET_FIELDS, since_id=latest_seen_tweet_id):
         response_json = response.json()
         if "data" in response_json:
-            tweets.extend(set_fetched_at_field(response_json["data"]))
+            tweets.extend(parse_tweets(response_json["data"]))
         else:
             logging.warning("No data returned for request %s", response.request.url)
         time.sleep(0.8)
@@ -200,7 +187,7 @@ def get_tweets_and_likes_for_user(user_id, latest_seen_tweet_id, latest_seen_lik
     for response in RawPaginator(TWITTER_CLIENT_RAW.get_liked_tweets, user_id, max_results=100, limit=7500, tweet_fields=["id", "created_at"]):
         response_json = response.json()
         if "data" in response_json:
-            likes.extend(add_liked_by_user_id_field(response_json["data"], user_id))
+            likes.extend(parse_likes(response_json["data"], user_id))
             # We should stop querying if we see liked tweet that is too old
             time_to_break = False
             for tweet in response_json["data"]:
@@ -217,15 +204,15 @@ def get_tweets_and_likes_for_user(user_id, latest_seen_tweet_id, latest_seen_lik
 
     # Collect all the liked and referenced tweet ids and query the information about them
     referenced_and_liked_tweet_ids = set()
-    influencer_tweet_ids = set([tweet["id"] for tweet in tweets])
+    influencer_tweet_ids = set([tweet.id for tweet in tweets])
 
     for tweet in tweets:
-        if "referenced_tweets" in tweet:
-            for t in tweet["referenced_tweets"]:
-                referenced_and_liked_tweet_ids.add(t["id"])
+        if tweet.referenced_tweets is not None:
+            for _, referenced_tweet_id in tweet.referenced_tweets:
+                referenced_and_liked_tweet_ids.add(referenced_tweet_id)
 
     for like in likes:
-        referenced_and_liked_tweet_ids.add(like["id"])
+        referenced_and_liked_tweet_ids.add(like.id)
 
     tweet_ids_to_fetch = list(referenced_and_liked_tweet_ids - influencer_tweet_ids)
 
@@ -239,24 +226,28 @@ def get_tweets_and_likes_for_user(user_id, latest_seen_tweet_id, latest_seen_lik
 
 def store_tweets_in_firestore(tweets):
     """
-    Saves an array of tweets to Firestore db "tweets" collection.
+    Saves an array of TweetRecord to Firestore db "tweets" collection.
 
-    If a tweet already exists in the collection, it's overwritten, which is fine because we'll get fresher engagement metrics
+    If a tweet already exists in the collection, it's overwritten, which is fine because we'll get fresher engagement metrics.
+    Writes are skipped for tweets that haven't changed since they were written earlier in the same workflow run,
+    e.g. the same referenced tweet fetched for several influencers (fetched_at is ignored).
     """
+    deduper = FirestoreWriteDeduper(FIRESTORE_DB, u"tweets")
     for tweet in tweets:
-        data_ref = FIRESTORE_DB.collection(u"tweets").document(tweet["id"])
-        data_ref.set(tweet)
+        deduper.set(tweet.id, tweet.to_dict())
+    deduper.flush()
 
 def store_likes_in_firestore(likes):
     """
-    Saves an array of liked tweets to Firestore db "likes" collection.
+    Saves an array of LikeRecord to Firestore db "likes" collection.
 
     We use tweet_id + liked_by_user as a key
     """
     for like in likes:
-        data_ref = FIRESTORE_DB.collection(u"likes").document(like["id"] + "|" + str(like["liked_by_user_id"])) # compound key because the same tweet can be liked by multiple users
-        data_ref.set(like)
+        data_ref = FIRESTORE_DB.collection(u"likes").document(like.id + "|" + str(like.liked_by_user_id)) # compound key because the same tweet can be liked by multiple users
+        data_ref.set(like.to_dict())
 
+@profile_invocation
 def download_new_tweets_and_likes_for_user(request):
     """
     Query Twitter API for fresh tweets and likes for a specific user and store them in Firestore
@@ -301,8 +292,8 @@ def get_user_ids_to_download(existing_user_ids):
 
     existing_user_ids is a set of user ids that already exist in our database
     """
-    tweets = FIRESTORE_DB.collection(u"tweets").stream()
-    all_user_ids = set([tweet.to_dict()["author_id"] for tweet in tweets])
+    tweets = stream_collection_parallel(FIRESTORE_DB, u"tweets", field_paths=["author_id"])
+    all_user_ids = set([tweet["author_id"] for tweet in tweets])
     return all_user_ids - existing_user_ids
 
 def get_users_by_ids(user_ids):
@@ -327,6 +318,7 @@ def get_users_by_ids(user_ids):
     time.sleep(3)
     return users
 
+@profile_invocation
 def download_new_users(request):
     """
     Look at the fresh tweets and download user information about tweet authors that are not yet in our database.
@@ -357,6 +349,13 @@ def download_new_users(request):
     logging.info("Done uploading users to Firestore")
     return (json.dumps({"status": "SUCCESS"}), 200, RESPONSE_HEADERS)
 
+# Columns of raw tweets table, except ds
+TWEETS_TABLE_COLUMNS = [
+    "id", "text", "author_id", "created_at", "fetched_at", "in_reply_to_user_id",
+    "retweet_count", "reply_count", "like_count", "quote_count",
+    "mentioned_users", "mentioned_urls", "mentioned_hashtags",
+]
+
 def convert_to_tweets_table_row(tweet):
     """
     Generate a flattened dict from Twitter API data representing one tweet.
@@ -388,11 +387,10 @@ def create_new_tweets_and_references_dataframes():
 
     Returns a tuple with two dataframes - one for tweets and the other one for referenced tweets.
     """
-    tweets = FIRESTORE_DB.collection(u"tweets").stream()
+    tweets = stream_collection_parallel(FIRESTORE_DB, u"tweets")
     tweets_list = []
     referenced_tweets = []
-    for tweet in tweets:
-        td = tweet.to_dict()
+    for td in tweets:
         tweets_list.append(convert_to_tweets_table_row(td))
         if "referenced_tweets" in td:
             for t in td["referenced_tweets"]:
@@ -401,7 +399,8 @@ def create_new_tweets_and_references_dataframes():
                     "referenced_tweet_id": int(t["id"]),
                     "type": t["type"],
                 })
-    tweets_df = pd.DataFrame(tweets_list)
+    # columns are only needed when there are no tweets, otherwise they come from the rows
+    tweets_df = pd.DataFrame(tweets_list, columns=None if tweets_list else TWEETS_TABLE_COLUMNS)
     # do necessary type conversions
     for field in ["id", "author_id"]:
         tweets_df[field] = pd.to_numeric(tweets_df[field])
@@ -409,7 +408,7 @@ def create_new_tweets_and_references_dataframes():
         tweets_df[field] = pd.to_datetime(tweets_df[field])
     tweets_df["in_reply_to_user_id"] = tweets_df["in_reply_to_user_id"].apply(convert_nullable_to_int)
 
-    ref_tweets_df = pd.DataFrame(referenced_tweets)
+    ref_tweets_df = pd.DataFrame(referenced_tweets, columns=["tweet_id", "referenced_tweet_id", "type"])
 
     return (tweets_df, ref_tweets_df)
 
@@ -419,9 +418,9 @@ def create_new_likes_dataframe():
 
     Returns dataframe.
     """
-    likes = FIRESTORE_DB.collection(u"likes").stream()
-    likes_df = pd.DataFrame([like.to_dict() for like in likes])
-    likes_df.drop(columns=["text"], inplace=True)
+    # we don't need tweet text for likes, so let's not download it
+    likes = stream_collection_parallel(FIRESTORE_DB, u"likes", field_paths=["id", "created_at", "liked_by_user_id"])
+    likes_df = pd.DataFrame(list(likes), columns=["id", "created_at", "liked_by_user_id"])
     likes_df["id"] = likes_df["id"].astype(np.int64)
     likes_df["created_at"] = pd.to_datetime(likes_df["created_at"])
     return likes_df
@@ -432,15 +431,21 @@ def create_new_users_dataframe():
 
     Returns dataframe.
     """
-    users = FIRESTORE_DB.collection(u"users").stream()
-    users_df = pd.DataFrame([user.to_dict() for user in users])
+    users = list(stream_collection_parallel(FIRESTORE_DB, u"users"))
+    users_df = pd.DataFrame(users, columns=None if users else ["id", "username", "name"])
     users_df["id"] = pd.to_numeric(users_df["id"])
     return users_df
 
 def upload_df_to_big_query_with_ds_partition(df, table_id):
     """
     Uploads dataframe to BigQuery table partitioned by ds field
+
+    Returns number of uploaded rows. Empty dataframes are not uploaded, the latest partition then stays the same as before,
+    and merging it again into the main tables is a no-op.
     """
+    if len(df) == 0:
+        logging.info("Nothing to upload to %s", table_id)
+        return 0
     table = BIGQUERY_CLIENT.get_table(table_id)
     # let's add ds field to our dataframe
     date_str = str(datetime.date.today())
@@ -449,8 +454,9 @@ def upload_df_to_big_query_with_ds_partition(df, table_id):
     BIGQUERY_CLIENT.query(f"DELETE {table_id} WHERE ds='{date_str}'")
     job = BIGQUERY_CLIENT.load_table_from_dataframe(df_copy, table)
 
-    return job.result()
+    return job.result().output_rows
 
+@profile_invocation
 def upload_tweets_from_firestore_to_big_query(request):
     """
     Get all the tweets stored in Firestore, upload them to Big Query raw data tables.
@@ -468,13 +474,14 @@ def upload_tweets_from_firestore_to_big_query(request):
     (tweets_df, referenced_tweets_df) = create_new_tweets_and_references_dataframes()
     logging.info("Got %d tweets and %d referenced tweets", len(tweets_df), len(referenced_tweets_df))
     logging.info("Uploading tweets to Big Query...")
-    result = upload_df_to_big_query_with_ds_partition(tweets_df, "TwitterDataRaw.tweets")
-    logging.info("Uploaded %d rows to Big Query. Now on to uploading referenced tweets", result.output_rows)
-    result = upload_df_to_big_query_with_ds_partition(referenced_tweets_df, "TwitterDataRaw.referenced_tweets")
-    logging.info("Uploaded %d rows to Big Query. We're done!", result.output_rows)
+    uploaded = upload_df_to_big_query_with_ds_partition(tweets_df, "TwitterDataRaw.tweets")
+    logging.info("Uploaded %d rows to Big Query. Now on to uploading referenced tweets", uploaded)
+    uploaded = upload_df_to_big_query_with_ds_partition(referenced_tweets_df, "TwitterDataRaw.referenced_tweets")
+    logging.info("Uploaded %d rows to Big Query. We're done!", uploaded)
     return (json.dumps({"status": "SUCCESS"}), 200, RESPONSE_HEADERS)
 
 
+@profile_invocation
 def upload_likes_from_firestore_to_big_query(request):
     """
     Get all the likes stored in Firestore, upload them to Big Query raw data tables.
@@ -492,11 +499,12 @@ def upload_likes_from_firestore_to_big_query(request):
     likes_df = create_new_likes_dataframe()
     logging.info("Got %d likes", len(likes_df))
     logging.info("Uploading likes to Big Query...")
-    result = upload_df_to_big_query_with_ds_partition(likes_df, "TwitterDataRaw.likes")
-    logging.info("Uploaded %d rows to Big Query. We're done!", result.output_rows)
+    uploaded = upload_df_to_big_query_with_ds_partition(likes_df, "TwitterDataRaw.likes")
+    logging.info("Uploaded %d rows to Big Query. We're done!", uploaded)
     return (json.dumps({"status": "SUCCESS"}), 200, RESPONSE_HEADERS)
 
 
+@profile_invocation
 def upload_users_from_firestore_to_big_query(request):
     """
     Get all the users stored in Firestore, upload them to Big Query raw data tables.
@@ -514,8 +522,8 @@ def upload_users_from_firestore_to_big_query(request):
     likes_df = create_new_users_dataframe()
     logging.info("Got %d users", len(likes_df))
     logging.info("Uploading users to Big Query...")
-    result = upload_df_to_big_query_with_ds_partition(likes_df, "TwitterDataRaw.users")
-    logging.info("Uploaded %d rows to Big Query. We're done!", result.output_rows)
+    uploaded = upload_df_to_big_query_with_ds_partition(likes_df, "TwitterDataRaw.users")
+    logging.info("Uploaded %d rows to Big Query. We're done!", uploaded)
     return (json.dumps({"status": "SUCCESS"}), 200, RESPONSE_HEADERS)
 
 def delete_collection(coll_ref, batch_size, collection_name):
@@ -535,6 +543,7 @@ def delete_collection(coll_ref, batch_size, collection_name):
     else:
         logging.info("Done deleting from collection %s", collection_name)
 
+@profile_invocation
 def cleanup_firestore_data(request):
     """
     Remove all temporary collections from the Firestore
@@ -552,6 +561,7 @@ def cleanup_firestore_data(request):
     BATCH_SIZE = 100
     logging.info("Deleting tweets collection")
     delete_collection(FIRESTORE_DB.collection(u"tweets"), BATCH_SIZE, "tweets")
+    delete_digests(FIRESTORE_DB, u"tweets")
     logging.info("Deleting likes collection")
     delete_collection(FIRESTORE_DB.collection(u"likes"), BATCH_SIZE, "likes")
     logging.info("Deleting users collection")
@@ -628,13 +638,14 @@ def get_popular_urls(days_in_range=30):
         SUM(IF(is_by_influencer, retweet_count, 0)) AS influencer_retweet_count,
         SUM(quote_count) AS quote_count,
         SUM(IF(is_by_influencer, quote_count, 0)) AS influencer_quote_count,
-        ARRAY_AGG(DISTINCT IF(is_by_influencer, author_username, NULL) IGNORE NULLS) AS mentioned_by_influencers,
+        ARRAY_AGG(DISTINCT IF(is_by_influencer, author_username, NULL) IGNORE NULLS ORDER BY IF(is_by_influencer, author_username, NULL)) AS mentioned_by_influencers,
         COALESCE(ARRAY_LENGTH(ARRAY_AGG(DISTINCT IF(is_by_influencer, author_username, NULL) IGNORE NULLS)), 0) AS influencer_count,
         ARRAY_LENGTH(ARRAY_AGG(DISTINCT author_username)) AS user_count,
-        ARRAY_AGG(CONCAT('https://twitter.com/', author_username, '/status/', id)) AS tweet_urls
+        -- most engaged tweets first, so that capping the list keeps the most interesting ones
+        ARRAY_AGG(CONCAT('https://twitter.com/', author_username, '/status/', id) ORDER BY retweet_count + quote_count DESC, id DESC) AS tweet_urls
     FROM url_mentions
     GROUP BY mentioned_url
-    ORDER BY mentions_count DESC, quote_count DESC
+    ORDER BY mentions_count DESC, quote_count DESC, mentioned_url
     LIMIT 50
     """
     df = BIGQUERY_CLIENT.query(query).to_dataframe()
@@ -644,6 +655,17 @@ def get_popular_urls(days_in_range=30):
     df["title"] = df["mentioned_url"].apply(fetch_page_title)
     return df
 
+# Columns rendered in the urls table on the website. Everything else goes into per-url detail documents.
+URL_SUMMARY_FIELDS = ["mentioned_url", "title", "mentions_count", "influencer_mentions_count", "quote_count", "retweet_count", "mentioned_by_influencers"]
+# Max number of tweet urls we store for each mentioned url. Popular urls can have thousands of mentions.
+MAX_TWEET_URLS_PER_URL = 100
+
+def get_url_detail_id(url):
+    """
+    Returns a short stable id of a detail document for a given mentioned url
+    """
+    return hashlib.blake2b(url.encode("utf-8"), digest_size=8).hexdigest()
+
 def save_popular_urls_to_firestore(urls_df, key):
     """
     Store most popular urls for a given timerange into Firestore.
@@ -651,14 +673,63 @@ def save_popular_urls_to_firestore(urls_df, key):
     urls_df - dataframe with urls stats
     key - string id corresponding to that time range. E.g. lastMonth, lastWeek or last2days
 
+    We store a compact summary document urlsData/{key} with the columns needed to render the urls table,
+    and a document per url in urlsData/{key}/details/{detail_id} with the list of tweets mentioning the url.
+    The website loads detail documents on demand. Only the documents whose content changed since the last time are written.
+
     Doesn't return anything
     """
-    urls = [row.to_dict() for _, row in urls_df.iterrows()]
-    doc = {
-        "urls": urls,
-    }
-    FIRESTORE_DB.collection("urlsData").document(key).set(doc)
+    summary_rows = []
+    details = {}
+    for _, row in urls_df.iterrows():
+        row = row.to_dict()
+        detail_id = get_url_detail_id(row["mentioned_url"])
+        tweet_urls = list(dict.fromkeys(row["tweet_urls"])) # dedup, preserving order
+        summary_row = {field: row[field] for field in URL_SUMMARY_FIELDS}
+        summary_row["detail_id"] = detail_id
+        summary_rows.append(summary_row)
+        details[detail_id] = {
+            "mentioned_url": row["mentioned_url"],
+            "title": row["title"],
+            "tweet_urls": tweet_urls[:MAX_TWEET_URLS_PER_URL],
+            "tweet_count": len(tweet_urls),
+        }
 
+    summary_ref = FIRESTORE_DB.collection("urlsData").document(key)
+    details_ref = summary_ref.collection("details")
+    existing = summary_ref.get()
+    existing = existing.to_dict() if existing.exists else {}
+    # digests of detail documents are kept in the summary, so that we can tell which details changed without reading them
+    existing_detail_digests = existing.get("detail_digests", {})
+    detail_digests = {detail_id: compute_digest(detail) for detail_id, detail in details.items()}
+
+    # write details first, so that the summary never points to missing documents
+    written = 0
+    for detail_id, detail in details.items():
+        if existing_detail_digests.get(detail_id) != detail_digests[detail_id]:
+            details_ref.document(detail_id).set(detail)
+            written += 1
+    logging.info("Wrote %d of %d url details for %s range", written, len(details), key)
+
+    content_digest = compute_digest({"urls": summary_rows, "detail_digests": detail_digests})
+    if existing.get("content_digest") == content_digest:
+        logging.info("Popular urls for %s range haven't changed, skipping the summary write", key)
+    else:
+        summary_ref.set({
+            "urls": summary_rows,
+            "detail_digests": detail_digests,
+            "content_digest": content_digest,
+        })
+
+    if "detail_digests" in existing:
+        stale_detail_ids = [detail_id for detail_id in existing_detail_digests if detail_id not in details]
+    else:
+        # summary written before we started tracking detail digests, we have to list the details
+        stale_detail_ids = [detail_doc.id for detail_doc in details_ref.list_documents() if detail_doc.id not in details]
+    for detail_id in stale_detail_ids:
+        details_ref.document(detail_id).delete()
+
+@profile_invocation
 def refresh_trending_urls_data(request):
     """
     Run BigQuery queries to get most popular urls for various time ranges. Upload the results into Firestore for use by website.
@@ -684,3 +755,155 @@ def refresh_trending_urls_data(request):
         save_popular_urls_to_firestore(get_popular_urls(days), key)
 
     return (json.dumps({"status": "SUCCESS"}), 200, RESPONSE_HEADERS)
+
+# Max number of tweets to refresh metrics for in one run. Twitter returns 100 tweets per request,
+# and we wait 3 seconds between requests, so this has to fit into the cloud function timeout.
+METRICS_REFRESH_QUOTA = 8000
+
+def ensure_tweet_metrics_checks_table():
+    """
+    Create TwitterData.tweet_metrics_checks table if it doesn't exist yet.
+
+    The table records when we last asked Twitter for metrics of a tweet. That's different from tweets.fetched_at,
+    which is when the metrics we have were actually fetched: deleted or protected tweets are never returned,
+    so their metrics stay old, but we still need to remember that we've tried.
+    """
+    schema = BIGQUERY_CLIENT.schema_from_json(os.path.join(os.path.dirname(__file__), "table_schemas", "tweet_metrics_checks.json"))
+    BIGQUERY_CLIENT.create_table(bigquery.Table("web3twitterdata.TwitterData.tweet_metrics_checks", schema=schema), exists_ok=True)
+
+def get_tweet_ids_for_metrics_refresh(days_in_range=30, quota=METRICS_REFRESH_QUOTA):
+    """
+    Select tweets from the trending window whose engagement metrics are most likely to be out of date.
+
+    We only look at tweets that mention urls other than twitter.com, because those are the ones that contribute to popular urls stats.
+    Tweets are ranked by the share of their lifetime that passed since the metrics were last checked
+    (metrics of a tweet fetched 1 hour after posting are much staler than of a tweet fetched after 10 days),
+    weighted by how much engagement the tweet already has.
+
+    Returns a list of up to quota tweet ids as strings.
+    """
+    query = """
+    WITH candidates AS (
+        SELECT
+            t.id,
+            t.created_at,
+            COALESCE(t.fetched_at, t.created_at) AS fetched_at,
+            GREATEST(COALESCE(t.fetched_at, t.created_at), COALESCE(c.metrics_checked_at, t.created_at)) AS checked_at,
+            COALESCE(t.retweet_count, 0) + COALESCE(t.quote_count, 0) AS engagement
+        FROM TwitterData.tweets AS t
+        LEFT JOIN TwitterData.tweet_metrics_checks AS c
+        ON t.id = c.id
+        WHERE t.created_at >= TIMESTAMP(DATE_SUB(CURRENT_DATE(), INTERVAL @days_in_range DAY))
+            AND EXISTS(SELECT 1 FROM UNNEST(t.mentioned_urls) AS mentioned_url WHERE mentioned_url NOT LIKE '%twitter.com%')
+    )
+    SELECT
+        id
+    FROM candidates
+    WHERE checked_at < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 12 HOUR)
+    ORDER BY
+        TIMESTAMP_DIFF(CURRENT_TIMESTAMP(), checked_at, HOUR) / (TIMESTAMP_DIFF(fetched_at, created_at, HOUR) + 1)
+            * LN(2 + engagement) DESC
+    LIMIT @quota
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("days_in_range", "INT64", days_in_range),
+        bigquery.ScalarQueryParameter("quota", "INT64", quota),
+    ])
+    df = BIGQUERY_CLIENT.query(query, job_config=job_config).to_dataframe()
+    return [str(tweet_id) for tweet_id in df.id.values]
+
+def create_tweet_metrics_dataframe(tweet_ids, tweets):
+    """
+    Create a dataframe with engagement metrics for requested tweet_ids from a list of TweetRecord returned by Twitter.
+
+    Every requested tweet gets a row with the current metrics_checked_at. Tweets that weren't returned
+    (deleted, protected, suspended authors) have NULL fetched_at and metrics, so their data in BigQuery stays as it is.
+
+    Returns dataframe that matches raw_tweet_metrics table schema.
+    """
+    metrics = []
+    returned_ids = set()
+    for tweet in tweets:
+        if tweet.public_metrics is None:
+            continue
+        row = dict(zip(TweetRecord.METRIC_NAMES, tweet.public_metrics))
+        row["id"] = int(tweet.id)
+        row["fetched_at"] = tweet.fetched_at
+        metrics.append(row)
+        returned_ids.add(tweet.id)
+    missing_ids = [tweet_id for tweet_id in tweet_ids if tweet_id not in returned_ids]
+    if missing_ids:
+        logging.info("No metrics returned for %d tweets", len(missing_ids))
+    for tweet_id in missing_ids:
+        metrics.append({"id": int(tweet_id)})
+    metrics_df = pd.DataFrame(metrics, columns=["id", "fetched_at"] + list(TweetRecord.METRIC_NAMES))
+    metrics_df["metrics_checked_at"] = pd.to_datetime(get_fetched_at())
+    metrics_df["fetched_at"] = pd.to_datetime(metrics_df["fetched_at"])
+    for field in TweetRecord.METRIC_NAMES:
+        metrics_df[field] = metrics_df[field].astype("Int64") # nullable integers
+    return metrics_df
+
+def update_tweet_metrics_in_big_query(metrics_df):
+    """
+    Upload fresh engagement metrics into TwitterDataRaw.tweet_metrics, update metric columns of the matching tweets in TwitterData.tweets,
+    and record the checks in TwitterData.tweet_metrics_checks
+
+    Returns number of updated tweets.
+    """
+    schema = BIGQUERY_CLIENT.schema_from_json(os.path.join(os.path.dirname(__file__), "table_schemas", "raw_tweet_metrics.json"))
+    job_config = bigquery.LoadJobConfig(schema=schema, write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+    BIGQUERY_CLIENT.load_table_from_dataframe(metrics_df, "TwitterDataRaw.tweet_metrics", job_config=job_config).result()
+    query = """
+    MERGE TwitterData.tweets AS t
+    USING TwitterDataRaw.tweet_metrics AS m
+    ON t.id = m.id
+    WHEN MATCHED AND m.fetched_at IS NOT NULL THEN UPDATE SET
+        retweet_count = COALESCE(m.retweet_count, t.retweet_count),
+        reply_count = COALESCE(m.reply_count, t.reply_count),
+        like_count = COALESCE(m.like_count, t.like_count),
+        quote_count = COALESCE(m.quote_count, t.quote_count),
+        fetched_at = m.fetched_at
+    """
+    job = BIGQUERY_CLIENT.query(query)
+    job.result()
+    checks_query = """
+    MERGE TwitterData.tweet_metrics_checks AS c
+    USING TwitterDataRaw.tweet_metrics AS m
+    ON c.id = m.id
+    WHEN MATCHED THEN UPDATE SET
+        metrics_checked_at = m.metrics_checked_at
+    WHEN NOT MATCHED THEN INSERT (id, metrics_checked_at) VALUES (m.id, m.metrics_checked_at)
+    """
+    BIGQUERY_CLIENT.query(checks_query).result()
+    return job.num_dml_affected_rows
+
+@profile_invocation
+def refresh_tweet_metrics(request):
+    """
+    Re-fetch engagement metrics for tweets in the trending window, starting with the stalest ones, and update them in BigQuery.
+
+    The daily workflow only fetches metrics for new tweets, so without this metrics of older tweets are frozen at the time they were first seen.
+    Should run after the tweets table was updated and before trending urls are computed.
+
+    HTTP Cloud Function. Accepts only POST requests, no body is needed.
+    Responds with json body:
+    {
+        "status": "SUCCESS"
+    }
+    """
+    if TWITTER_CLIENT_RAW is None:
+        logging.error("Twitter client hasn't been initialized. Make sure environment variables are set. Exiting ...")
+    if request.method != "POST":
+        logging.error("Incorrect method: %s", request.method)
+        return (json.dumps({"status": "INVALID_REQUEST"}), 400, RESPONSE_HEADERS)
+    logging.info("Selecting tweets for metrics refresh...")
+    ensure_tweet_metrics_checks_table()
+    tweet_ids = get_tweet_ids_for_metrics_refresh()
+    logging.info("Fetching metrics for %d tweets", len(tweet_ids))
+    tweets = get_tweets_by_ids(tweet_ids, tweet_fields=["public_metrics"])
+    metrics_df = create_tweet_metrics_dataframe(tweet_ids, tweets)
+    logging.info("Got %d metric rows, including tweets that were not returned. Updating Big Query...", len(metrics_df))
+    if len(metrics_df) > 0:
+        updated = update_tweet_metrics_in_big_query(metrics_df)
+        logging.info("Updated metrics for %d tweets. We're done!", updated)
+    return (json.dumps({"status": "SUCCESS"}), 200, RESPONSE_HEADERS)
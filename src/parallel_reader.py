@@ -0,0 +1,100 @@
+#########################################################################################
+# Read a whole Firestore collection using several concurrent streams instead of one.
+# The collection is split into document key ranges with Firestore partition queries,
+# and each range is streamed on its own thread.
+#########################################################################################
+
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PARTITION_COUNT = 8
+
+def get_partition_queries(db, collection_name, partition_count=DEFAULT_PARTITION_COUNT):
+    """
+    Split a top-level collection into queries over disjoint document key ranges.
+
+    Firestore only supports partition queries for collection groups, which is equivalent for our
+    staging collections, because there are no subcollections with the same name.
+    Firestore may return fewer partitions than requested, e.g. for small collections.
+
+    Returns a list of queries.
+    """
+    partitions = db.collection_group(collection_name).get_partitions(partition_count)
+    return [partition.query() for partition in partitions]
+
+# Documents are handed over from worker threads in chunks of this size, through a queue of at most
+# MAX_QUEUED_CHUNKS chunks, so that memory use doesn't depend on the size of a partition.
+CHUNK_SIZE = 100
+MAX_QUEUED_CHUNKS = 16
+
+class _PartitionDone:
+    """
+    Queue item that marks the end of a partition. Carries the exception if the partition failed.
+    """
+    def __init__(self, error=None):
+        self.error = error
+
+def stream_partition(query, output_queue, stop_event, field_paths=None):
+    """
+    Stream all documents matched by a partition query into output_queue, in lists of up to CHUNK_SIZE document dictionaries.
+
+    Puts _PartitionDone into the queue when finished. Stops early if stop_event is set.
+    """
+    def put(item):
+        # don't block forever if the reader went away
+        while not stop_event.is_set():
+            try:
+                output_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        if field_paths is not None:
+            query = query.select(field_paths)
+        chunk = []
+        for doc in query.stream():
+            chunk.append(doc.to_dict())
+            if len(chunk) >= CHUNK_SIZE:
+                if not put(chunk):
+                    return
+                chunk = []
+        if chunk and not put(chunk):
+            return
+        put(_PartitionDone())
+    except Exception as ex:
+        put(_PartitionDone(ex))
+
+def stream_collection_parallel(db, collection_name, field_paths=None, partition_count=DEFAULT_PARTITION_COUNT, max_workers=None):
+    """
+    Read all documents from a Firestore collection using concurrent streams.
+
+    field_paths - optional list of fields to fetch. Other fields are not transferred over the network.
+    partition_count - desired number of key ranges to split the collection into.
+    max_workers - number of threads, defaults to the number of partitions.
+
+    Yields document dictionaries as they arrive. The order of documents is not defined.
+    """
+    queries = get_partition_queries(db, collection_name, partition_count)
+    logging.info("Reading collection %s in %d partitions", collection_name, len(queries))
+    output_queue = queue.Queue(maxsize=MAX_QUEUED_CHUNKS)
+    stop_event = threading.Event()
+    with ThreadPoolExecutor(max_workers=max_workers or len(queries)) as executor:
+        for query in queries:
+            executor.submit(stream_partition, query, output_queue, stop_event, field_paths)
+        try:
+            remaining = len(queries)
+            while remaining > 0:
+                item = output_queue.get()
+                if isinstance(item, _PartitionDone):
+                    if item.error is not None:
+                        raise item.error
+                    remaining -= 1
+                else:
+                    yield from item
+        finally:
+            # let the workers exit if we're done early, e.g. because of an error
+            stop_event.set()
@@ -0,0 +1,137 @@
+#########################################################################################
+# Compact in-memory representation of tweets and likes fetched from Twitter API.
+# We can hold thousands of them during one invocation, so instead of raw json dicts we keep
+# only the fields that we persist, in __slots__ classes, with repeated strings interned.
+#########################################################################################
+
+import sys
+import time
+
+def get_fetched_at():
+    """
+    Returns current time formatted the same way as timestamps in Twitter API responses
+    """
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+
+def intern_or_none(s):
+    return None if s is None else sys.intern(s)
+
+class TweetRecord:
+    """
+    Tweet fields that we store in Firestore.
+
+    to_dict() returns a dictionary in the same format as Twitter API json, limited to the fields we use,
+    so that the documents in Firestore can be processed the same way as the raw API responses.
+    """
+    __slots__ = (
+        "id", "text", "author_id", "created_at", "fetched_at", "in_reply_to_user_id",
+        "public_metrics", "mentioned_urls", "mentioned_hashtags", "mentioned_users", "referenced_tweets",
+    )
+    METRIC_NAMES = ("retweet_count", "reply_count", "like_count", "quote_count")
+
+    def __init__(self, id, text, author_id, created_at, fetched_at, in_reply_to_user_id,
+                 public_metrics, mentioned_urls, mentioned_hashtags, mentioned_users, referenced_tweets):
+        self.id = id
+        self.text = text
+        self.author_id = author_id
+        self.created_at = created_at
+        self.fetched_at = fetched_at
+        self.in_reply_to_user_id = in_reply_to_user_id
+        self.public_metrics = public_metrics # tuple (retweet_count, reply_count, like_count, quote_count) or None
+        self.mentioned_urls = mentioned_urls # tuple of expanded urls or None
+        self.mentioned_hashtags = mentioned_hashtags # tuple of tags or None
+        self.mentioned_users = mentioned_users # tuple of usernames or None
+        self.referenced_tweets = referenced_tweets # tuple of (type, tweet_id) pairs or None
+
+    @classmethod
+    def from_json(cls, data, fetched_at):
+        """
+        Create a record from tweet json returned by Twitter API
+        """
+        public_metrics = None
+        if "public_metrics" in data:
+            public_metrics = tuple(data["public_metrics"].get(name) for name in cls.METRIC_NAMES)
+        entities = data.get("entities", {})
+        mentioned_urls = None
+        if "urls" in entities:
+            mentioned_urls = tuple(url["expanded_url"] for url in entities["urls"] if "expanded_url" in url)
+        mentioned_hashtags = None
+        if "hashtags" in entities:
+            mentioned_hashtags = tuple(sys.intern(hashtag["tag"]) for hashtag in entities["hashtags"])
+        mentioned_users = None
+        if "mentions" in entities:
+            mentioned_users = tuple(sys.intern(mention["username"]) for mention in entities["mentions"])
+        referenced_tweets = None
+        if "referenced_tweets" in data:
+            referenced_tweets = tuple((sys.intern(t["type"]), t["id"]) for t in data["referenced_tweets"])
+        return cls(
+            id=data["id"],
+            text=data.get("text"),
+            author_id=intern_or_none(data.get("author_id")),
+            created_at=data.get("created_at"),
+            fetched_at=fetched_at,
+            in_reply_to_user_id=intern_or_none(data.get("in_reply_to_user_id")),
+            public_metrics=public_metrics,
+            mentioned_urls=mentioned_urls,
+            mentioned_hashtags=mentioned_hashtags,
+            mentioned_users=mentioned_users,
+            referenced_tweets=referenced_tweets,
+        )
+
+    def to_dict(self):
+        """
+        Returns a dictionary in Twitter API json format, with the fields that were present in the original json
+        """
+        result = {key: getattr(self, key) for key in ["id", "text", "author_id", "created_at", "fetched_at", "in_reply_to_user_id"] if getattr(self, key) is not None}
+        if self.public_metrics is not None:
+            result["public_metrics"] = dict(zip(self.METRIC_NAMES, self.public_metrics))
+        entities = {}
+        if self.mentioned_urls is not None:
+            entities["urls"] = [{"expanded_url": url} for url in self.mentioned_urls]
+        if self.mentioned_hashtags is not None:
+            entities["hashtags"] = [{"tag": tag} for tag in self.mentioned_hashtags]
+        if self.mentioned_users is not None:
+            entities["mentions"] = [{"username": username} for username in self.mentioned_users]
+        if entities:
+            result["entities"] = entities
+        if self.referenced_tweets is not None:
+            result["referenced_tweets"] = [{"type": type, "id": id} for type, id in self.referenced_tweets]
+        return result
+
+class LikeRecord:
+    """
+    Liked tweet fields that we store in Firestore
+    """
+    __slots__ = ("id", "created_at", "liked_by_user_id")
+
+    def __init__(self, id, created_at, liked_by_user_id):
+        self.id = id
+        self.created_at = created_at
+        self.liked_by_user_id = liked_by_user_id
+
+    @classmethod
+    def from_json(cls, data, liked_by_user_id):
+        """
+        Create a record from liked tweet json returned by Twitter API
+        """
+        return cls(data["id"], data["created_at"], liked_by_user_id)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "created_at": self.created_at,
+            "liked_by_user_id": self.liked_by_user_id,
+        }
+
+def parse_tweets(tweets_json):
+    """
+    Convert a list of tweets json from Twitter API response into a list of TweetRecord. Fetched at is set to the current time.
+    """
+    fetched_at = get_fetched_at()
+    return [TweetRecord.from_json(tweet, fetched_at) for tweet in tweets_json]
+
+def parse_likes(likes_json, user_id):
+    """
+    Convert a list of liked tweets json from Twitter API response into a list of LikeRecord liked by user_id
+    """
+    return [LikeRecord.from_json(like, user_id) for like in likes_json]
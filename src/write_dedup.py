@@ -0,0 +1,129 @@
+#########################################################################################
+# Skip Firestore writes whose payload hasn't changed since the last time we wrote it.
+# We keep a short content digest per document key and persist the digests in Firestore,
+# so that successive function invocations of one workflow run (one per influencer) can share them.
+# Digests only live as long as the staging collection itself: the workflow relies on every document
+# that is relevant to the current run being present in staging, e.g. to resolve usernames of referenced tweets.
+#########################################################################################
+
+import hashlib
+import json
+import logging
+import zlib
+
+# Firestore collection that holds the digests. Each staging collection gets NUM_SHARDS documents,
+# to stay well below 1MB per document. Digests only cover one day of data, about 20 bytes per key when packed,
+# so a few shards are enough, and every invocation reads and rewrites only a few documents.
+DIGESTS_COLLECTION = u"write_digests"
+NUM_SHARDS = 4
+
+# Fields that change on every fetch but don't carry any information worth rewriting a document for
+DEFAULT_EXCLUDED_FIELDS = ("fetched_at",)
+
+def compute_digest(doc, excluded_fields=DEFAULT_EXCLUDED_FIELDS):
+    """
+    Compute a compact digest of a document, ignoring excluded_fields.
+
+    Returns a 16 character hex string.
+    """
+    content = {key: value for key, value in doc.items() if key not in excluded_fields}
+    serialized = json.dumps(content, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(serialized.encode("utf-8"), digest_size=8).hexdigest()
+
+def get_shard_id(collection_name, key):
+    """
+    Returns id of the digests document that holds the digest for a given document key
+    """
+    shard = int(hashlib.blake2b(key.encode("utf-8"), digest_size=2).hexdigest(), 16) % NUM_SHARDS
+    return f"{collection_name}_{shard}"
+
+def pack_digests(digests):
+    """
+    Pack {key: digest} map into compressed bytes, one "key digest" line per entry
+    """
+    lines = [f"{key} {digest}" for key, digest in digests.items()]
+    return zlib.compress("\n".join(lines).encode("utf-8"))
+
+def unpack_digests(packed):
+    """
+    Unpack bytes produced by pack_digests into {key: digest} map
+    """
+    digests = {}
+    for line in zlib.decompress(packed).decode("utf-8").splitlines():
+        key, digest = line.split(" ")
+        digests[key] = digest
+    return digests
+
+class FirestoreWriteDeduper:
+    """
+    Writes documents into a Firestore collection, skipping the writes when the document content is unchanged.
+
+    Usage:
+        deduper = FirestoreWriteDeduper(FIRESTORE_DB, "tweets")
+        for tweet in tweets:
+            deduper.set(tweet["id"], tweet)
+        deduper.flush()
+
+    All digest shards are loaded with one batched read when they're first needed, and the ones that changed
+    are saved back by flush(). Each shard document holds
+    all its digests packed into a single bytes field "packed", so that a shard is one index entry no matter how
+    many keys it has, instead of one index entry per key as it would be with a map field.
+    The digests are only valid while the documents they describe exist, so they have to be deleted together with
+    the collection (see delete_digests).
+    Invocations that write to the same collection are expected to run sequentially, as they do in our workflow.
+    """
+
+    def __init__(self, db, collection_name, excluded_fields=DEFAULT_EXCLUDED_FIELDS):
+        self.db = db
+        self.collection_name = collection_name
+        self.excluded_fields = excluded_fields
+        self.shards = None
+        self.dirty_shards = set()
+        self.written = 0
+        self.skipped = 0
+
+    def load(self):
+        """
+        Load all digest shards of the collection from Firestore in one batched read
+        """
+        refs = [self.db.collection(DIGESTS_COLLECTION).document(f"{self.collection_name}_{n}") for n in range(NUM_SHARDS)]
+        self.shards = {ref.id: {} for ref in refs}
+        for snapshot in self.db.get_all(refs):
+            if snapshot.exists:
+                self.shards[snapshot.id] = unpack_digests(snapshot.to_dict()["packed"])
+
+    def set(self, key, doc):
+        """
+        Write doc under key unless a document with the same content was already written.
+
+        Returns True if the document was written, False if the write was skipped.
+        """
+        if self.shards is None:
+            self.load()
+        shard_id = get_shard_id(self.collection_name, key)
+        digests = self.shards[shard_id]
+        digest = compute_digest(doc, self.excluded_fields)
+        if digests.get(key) == digest:
+            self.skipped += 1
+            return False
+        self.db.collection(self.collection_name).document(key).set(doc)
+        digests[key] = digest
+        self.dirty_shards.add(shard_id)
+        self.written += 1
+        return True
+
+    def flush(self):
+        """
+        Persist digest shards that changed since they were loaded, and log write stats.
+        """
+        for shard_id in self.dirty_shards:
+            self.db.collection(DIGESTS_COLLECTION).document(shard_id).set({"packed": pack_digests(self.shards[shard_id])})
+        self.dirty_shards = set()
+        logging.info("Collection %s: wrote %d documents, skipped %d unchanged documents", self.collection_name, self.written, self.skipped)
+
+def delete_digests(db, collection_name):
+    """
+    Delete persisted digests for a collection. Has to be called whenever the collection itself is deleted.
+    """
+    for n in range(NUM_SHARDS):
+        db.collection(DIGESTS_COLLECTION).document(f"{collection_name}_{n}").delete()
@@ -44,9 +44,6 @@ const RANGE_OPTIONS = [
 ];
 const ACCEPTABLE_RANGE_VALUES = RANGE_OPTIONS.map(option => option.value);
 
-// This is super UGLY, but I need to share the state between App and TweetsView, and that's the easiest way that I know
-var URLS_GLOBAL = [];
-
 // Initialize Firebase
 initializeApp(firebaseConfig);
 const db = getFirestore();
@@ -65,16 +62,35 @@ async function getPopularUrls(range) {
   const docSnap = await getDoc(doc(db, "urlsData", range));
 
   if (docSnap.exists()) {
-    const urls = docSnap.data().urls;
-    // let's add index to each url so that we can link to "view tweets" page
-    urls.forEach((url, i) => { url.index = i; });
-    return urls;
+    return docSnap.data().urls;
   } else {
     console.error("The document doesn't exist", range);
     return [];
   }
 }
 
+/**
+ * Load details about a popular url, including tweets that mention it.
+ *
+ * @param {string} range - date range, one of ACCEPTABLE_RANGE_VALUES
+ * @param {string} detailId - detail_id field of the url in the summary document
+ * @returns structure with url details, or null if it doesn't exist
+ */
+async function getUrlDetails(range, detailId) {
+  if (!ACCEPTABLE_RANGE_VALUES.includes(range)) {
+    console.error("Invalid range value", range);
+    return null;
+  }
+  const docSnap = await getDoc(doc(db, "urlsData", range, "details", detailId));
+
+  if (docSnap.exists()) {
+    return docSnap.data();
+  } else {
+    console.error("The document doesn't exist", range, detailId);
+    return null;
+  }
+}
+
 /**
  * Get the current value for date range from url.
  * @returns one of the values from ACCEPTABLE_RANGE_VALUES
@@ -128,9 +144,10 @@ function RangeSelector({selectedRange}) {
  * React component that displays a table with popular urls and their stats.
  *
  * @param {struct[]} urls - array of structures describing popular urls and their statistics
+ * @param {string} range - currently selected date range, a value from ACCEPTABLE_RANGE_VALUES
  * @returns
  */
-function UrlsTable({urls}) {
+function UrlsTable({urls, range}) {
   // table column definitions
   const columns = React.useMemo(() => [
     {
@@ -170,12 +187,12 @@ function UrlsTable({urls}) {
     },
     {
       Header: 'Tweets',
-      accessor: 'index',
+      accessor: 'detail_id',
       Cell: ({value}) => {
-        return (<Link to={"/tweets/" + value}>View</Link>);
+        return (<Link to={"/tweets/" + value + "?range=" + range}>View</Link>);
       }
     }
-  ], []);
+  ], [range]);
 
   const {
     getTableProps,
@@ -244,7 +261,6 @@ export class App extends React.Component {
       console.log("user signed in");
       // Load popular urls
       getPopularUrls(this.state.range).then((urls) => {
-        URLS_GLOBAL = urls;
         this.setState((state, props) => ({ urls }));
       });
     })
@@ -261,7 +277,7 @@ export class App extends React.Component {
         <br/>
         <RangeSelector selectedRange={this.state.range} />
         <br/>
-        <UrlsTable urls={this.state.urls} />
+        <UrlsTable urls={this.state.urls} range={this.state.range} />
       </div>
     );
   }
@@ -269,12 +285,32 @@ export class App extends React.Component {
 
 export function TweetsView() {
   const params = useParams();
-  const urlData = URLS_GLOBAL.find(url => (url.index === parseInt(params.urlId, 10)));
+  const range = getRangeParameter();
+  // undefined while loading, null if the url wasn't found
+  const [urlData, setUrlData] = React.useState(undefined);
+
+  React.useEffect(() => {
+    signInAnonymously(auth)
+    .then(() => getUrlDetails(range, params.urlId))
+    .then(setUrlData)
+    .catch((error) => {
+      console.error("failed to load url details", error.code, error.message);
+      setUrlData(null);
+    });
+  }, [range, params.urlId]);
+
+  if (urlData === undefined) {
+    return (<div>Loading...</div>);
+  }
   if (!urlData) {
     return (<div>URL not found! {params.urlId}</div>);
   }
   const tweets = urlData.tweet_urls.map(url => (<div key={url}><a href={url}>{url}</a></div>));
   return (
-    <div>{tweets}</div>
+    <div>
+      <div><a href={urlData.mentioned_url}>{urlData.title}</a></div>
+      <div>Showing {urlData.tweet_urls.length} of {urlData.tweet_count} tweets</div>
+      {tweets}
+    </div>
   );
 }